@@ -0,0 +1,291 @@
+# anomaly.py
+import os
+import json
+from datetime import date, timedelta
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Sale
+
+# --------------------------------------------------
+# Config
+# --------------------------------------------------
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", 0.2))          # EWMA smoothing factor
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", 3.0))
+ANOMALY_MIN_HISTORY = int(os.getenv("ANOMALY_MIN_HISTORY", 6))  # closed periods before alerting
+ANOMALY_SEED_DAYS = int(os.getenv("ANOMALY_SEED_DAYS", 180))
+# Empty periods folded in as zeros when a series jumps ahead. A longer gap resets
+# the series instead: that many zeros would drag the EWMA to ~0 and fire false alerts.
+ANOMALY_MAX_GAP_PERIODS = int(os.getenv("ANOMALY_MAX_GAP_PERIODS", 31))
+
+# Mean absolute deviation of a normal distribution is sigma * sqrt(2/pi).
+MAD_TO_SIGMA = 1.2533
+
+GRANULARITIES = ("day", "month")
+
+def bucket_for(granularity: str, d: date) -> date:
+    return d if granularity == "day" else d.replace(day=1)
+
+def next_bucket(granularity: str, d: date) -> date:
+    if granularity == "day":
+        return d + timedelta(days=1)
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+def periods_between(granularity: str, start: date, end: date) -> int:
+    """Number of whole periods strictly between two buckets."""
+    if granularity == "day":
+        return (end - start).days - 1
+    return (end.year - start.year) * 12 + end.month - start.month - 1
+
+# --------------------------------------------------
+# Write notifications
+# --------------------------------------------------
+# Each write NOTIFYs every worker with its sales deltas, so every detector sees
+# the full stream (in commit order) rather than only the writes it served.
+def write_payload(worker_id: str, changes: list[tuple[str, date, float]]) -> str:
+    return json.dumps({
+        "worker": worker_id,
+        "changes": [[cat, d.isoformat(), float(amount)] for cat, d, amount in changes],
+    })
+
+def parse_write_payload(payload: str) -> tuple[str, list[tuple[str, date, float]]] | None:
+    """Return (worker_id, changes) for a write notification, None for any other payload."""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or "changes" not in data:
+        return None
+    changes = [(cat, date.fromisoformat(d), float(amount)) for cat, d, amount in data["changes"]]
+    return data.get("worker"), changes
+
+# --------------------------------------------------
+# Per-series state
+# --------------------------------------------------
+class SeriesStats:
+    """
+    Rolling state for one (category, granularity) series: the open period's
+    running total plus an EWMA of past period totals and of their absolute
+    deviation. Constant memory regardless of history length.
+    """
+    __slots__ = ("bucket", "total", "mean", "mad", "n", "flagged")
+
+    def __init__(self):
+        self.restart(None)
+
+    def restart(self, bucket: date | None):
+        """Drop all history and open `bucket` as the first period."""
+        self.bucket = bucket
+        self.total = 0.0
+        self.mean = 0.0
+        self.mad = 0.0
+        self.n = 0
+        self.flagged = set()
+
+    def absorb(self, value: float):
+        """Fold a closed period's total into the EWMA statistics."""
+        if self.n == 0:
+            self.mean = value
+        else:
+            dev = abs(value - self.mean)
+            self.mad = ANOMALY_ALPHA * dev + (1 - ANOMALY_ALPHA) * self.mad
+            self.mean = ANOMALY_ALPHA * value + (1 - ANOMALY_ALPHA) * self.mean
+        self.n += 1
+
+    def zscore(self, value: float) -> float | None:
+        if self.n < ANOMALY_MIN_HISTORY or self.mad <= 0:
+            return None
+        return (value - self.mean) / (self.mad * MAD_TO_SIGMA)
+
+    def snapshot(self) -> dict:
+        return {
+            "period": self.bucket.isoformat() if self.bucket else None,
+            "current_total": round(self.total, 2),
+            "ewma_mean": round(self.mean, 2),
+            "ewma_mad": round(self.mad, 2),
+            "periods_seen": self.n,
+        }
+
+# --------------------------------------------------
+# Detector
+# --------------------------------------------------
+class StreamingDetector:
+    """
+    Incrementally tracks daily and monthly sales totals per category (plus
+    "All") from individual writes and flags:
+
+    - spike / drop: the period total is more than ANOMALY_Z_THRESHOLD robust
+      z-scores away from the EWMA of previous periods. Spikes are raised as
+      soon as the open period crosses the threshold; drops once it closes.
+    - above_forecast / below_forecast: a monthly total falls outside the
+      latest /predict interval for that month.
+    """
+
+    def __init__(self):
+        self.series: dict[tuple[str, str], SeriesStats] = {}
+        # category -> {month: (yhat, yhat_lower, yhat_upper)}
+        self.forecasts: dict[str, dict[date, tuple]] = {}
+
+    def reset(self):
+        self.series.clear()
+
+    def set_forecast(self, category: str, rows: list[dict]):
+        self.forecasts[category] = {
+            date.fromisoformat(r["ds"]): (r["yhat"], r["yhat_lower"], r["yhat_upper"])
+            for r in rows
+        }
+
+    def record(self, category: str, order_date: date, amount: float, today: date | None = None) -> list[dict]:
+        """Apply one write (negative amount for deletes/reversals) and return any anomaly events."""
+        events = []
+        if order_date > (today or date.today()):
+            # A future-dated order would move every series ahead and turn all
+            # real writes into ignored "late" ones until the next reseed.
+            return events
+        keys = {category or "Unknown", "All"}
+        for cat in keys:
+            for granularity in GRANULARITIES:
+                events += self._update(cat, granularity, bucket_for(granularity, order_date), amount)
+        return events
+
+    def apply(self, changes: list[tuple[str, date, float]], today: date | None = None) -> list[dict]:
+        events = []
+        for category, order_date, amount in changes:
+            events += self.record(category, order_date, amount, today)
+        return events
+
+    def seed(self, category: str, granularity: str, history: list[tuple[date, float]]):
+        """Replay ordered (period, total) history without emitting events."""
+        s = self.series.setdefault((category, granularity), SeriesStats())
+        for bucket, total in history:
+            if s.bucket is None:
+                s.bucket = bucket
+            elif bucket > s.bucket:
+                self._advance(category, granularity, s, bucket)
+            elif bucket < s.bucket:
+                continue
+            s.total += total
+
+    def state(self) -> list[dict]:
+        return [
+            {"category": cat, "granularity": gran, **s.snapshot()}
+            for (cat, gran), s in sorted(self.series.items())
+        ]
+
+    # ---------------- internals ---------------- #
+    def _update(self, category: str, granularity: str, bucket: date, amount: float) -> list[dict]:
+        s = self.series.setdefault((category, granularity), SeriesStats())
+        events = []
+        if s.bucket is None:
+            s.bucket = bucket
+        elif bucket > s.bucket:
+            events += self._advance(category, granularity, s, bucket)
+        elif bucket < s.bucket:
+            # Late write into an already-closed period: its total is folded into
+            # the EWMA already and is not kept, so it cannot be revised here.
+            return events
+        s.total += amount
+        events += self._check_open(category, granularity, s)
+        return events
+
+    def _check_open(self, category: str, granularity: str, s: SeriesStats) -> list[dict]:
+        events = []
+        z = s.zscore(s.total)
+        if z is not None and z > ANOMALY_Z_THRESHOLD and "spike" not in s.flagged:
+            s.flagged.add("spike")
+            events.append(self._event("spike", category, granularity, s, z=z, partial=True))
+        band = self._band(category, granularity, s.bucket)
+        if band and s.total > band[2] and "above_forecast" not in s.flagged:
+            s.flagged.add("above_forecast")
+            events.append(self._event("above_forecast", category, granularity, s, band=band, partial=True))
+        return events
+
+    def _advance(self, category: str, granularity: str, s: SeriesStats, bucket: date) -> list[dict]:
+        """
+        Close the open period and every empty period between it and `bucket`
+        as zero totals, then open `bucket`. A gap longer than
+        ANOMALY_MAX_GAP_PERIODS resets the series: the old baseline no longer
+        describes the data, so it starts learning again from `bucket`.
+        """
+        if periods_between(granularity, s.bucket, bucket) > ANOMALY_MAX_GAP_PERIODS:
+            s.restart(bucket)
+            return []
+        events = self._close(category, granularity, s)
+        gap = next_bucket(granularity, s.bucket)
+        while gap < bucket:
+            s.bucket, s.total, s.flagged = gap, 0.0, set()
+            events += self._close(category, granularity, s)
+            gap = next_bucket(granularity, gap)
+        s.bucket, s.total, s.flagged = bucket, 0.0, set()
+        return events
+
+    def _close(self, category: str, granularity: str, s: SeriesStats) -> list[dict]:
+        events = []
+        z = s.zscore(s.total)
+        if z is not None and z < -ANOMALY_Z_THRESHOLD:
+            events.append(self._event("drop", category, granularity, s, z=z))
+        band = self._band(category, granularity, s.bucket)
+        if band and s.total < band[1]:
+            events.append(self._event("below_forecast", category, granularity, s, band=band))
+        s.absorb(s.total)
+        return events
+
+    def _band(self, category: str, granularity: str, bucket: date):
+        if granularity != "month":
+            return None
+        band = self.forecasts.get(category, {}).get(bucket)
+        if not band or band[1] is None or band[2] is None:
+            return None
+        return band
+
+    def _event(self, kind, category, granularity, s, z=None, band=None, partial=False) -> dict:
+        event = {
+            "type": "anomaly",
+            "kind": kind,
+            "category": category,
+            "granularity": granularity,
+            "period": s.bucket.isoformat(),
+            "value": round(s.total, 2),
+            "expected": round(s.mean, 2),
+            "partial": partial,
+        }
+        if z is not None:
+            event["zscore"] = round(z, 2)
+        if band is not None:
+            event["expected"] = round(band[0], 2)
+            event["forecast_lower"] = round(band[1], 2)
+            event["forecast_upper"] = round(band[2], 2)
+        return event
+
+# --------------------------------------------------
+# Seeding from the DB
+# --------------------------------------------------
+async def seed_from_db(detector: StreamingDetector, session: AsyncSession):
+    """Rebuild detector state from aggregated history (startup and bulk reloads only)."""
+    latest = await session.scalar(select(func.max(Sale.order_date)))
+    if latest is None:
+        detector.reset()
+        return
+    since = latest - timedelta(days=ANOMALY_SEED_DAYS)
+    month = func.date_trunc("month", Sale.order_date)
+    queries = {
+        "day": select(Sale.product_category, Sale.order_date, func.sum(Sale.sales))
+        .where(Sale.order_date >= since)
+        .group_by(Sale.product_category, Sale.order_date),
+        "month": select(Sale.product_category, month, func.sum(Sale.sales))
+        .group_by(Sale.product_category, month),
+    }
+    # Build into a scratch detector and swap at the end so live writes keep working meanwhile.
+    fresh = StreamingDetector()
+    for granularity, stmt in queries.items():
+        rows = (await session.execute(stmt)).all()
+        per_cat: dict[str, dict[date, float]] = {}
+        for cat, bucket, total in rows:
+            if hasattr(bucket, "date"):
+                bucket = bucket.date()
+            for key in (cat, "All"):
+                per_cat.setdefault(key, {})
+                per_cat[key][bucket] = per_cat[key].get(bucket, 0.0) + float(total or 0.0)
+        for cat, totals in per_cat.items():
+            fresh.seed(cat, granularity, sorted(totals.items()))
+    detector.series = fresh.series
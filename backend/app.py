@@ -1,12 +1,13 @@
+import time
+_import_started = time.perf_counter()
+
 import os
 import json
 import logging
 import asyncio
 import asyncpg
+import uuid
 import pandas as pd
-import numpy as np
-import joblib
-import time
 from typing import List, Optional
 from contextlib import asynccontextmanager
 from datetime import date, time as dtime
@@ -16,13 +17,17 @@ from fastapi import (
     HTTPException, Query, BackgroundTasks, Depends, Path
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from prophet import Prophet  # type: ignore
 from pydantic import BaseModel
 
-from database import AsyncSessionLocal, get_session
+from database import AsyncSessionLocal, engine, get_session
 from models import Sale
+import forecasting
+import customer_analytics
+import anomaly
+import retrain
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -61,6 +66,7 @@ class ConnectionManager:
             self.disconnect(conn)
 
 manager = ConnectionManager()
+detector = anomaly.StreamingDetector()
 
 async def broadcast_data_update():
     await manager.broadcast({
@@ -68,6 +74,19 @@ async def broadcast_data_update():
         "message": "Database data updated. Refreshing dashboard data..."
     })
 
+async def broadcast_anomalies(events: list[dict]):
+    for event in events:
+        logger.warning(f"🚨 Anomaly: {event}")
+        await manager.broadcast(event)
+
+async def reseed_detector():
+    try:
+        async with AsyncSessionLocal() as session:
+            await anomaly.seed_from_db(detector, session)
+        logger.info("📈 Anomaly detector seeded from sales history.")
+    except Exception as e:
+        logger.error(f"Anomaly detector seeding failed: {e}")
+
 # --------------------------------------------------
 # Simple In-Memory Cache
 # --------------------------------------------------
@@ -97,6 +116,24 @@ def clear_cache(prefix: Optional[str] = None):
             removed += 1
     logger.info(f"🧹 Cache cleared for prefix '{prefix}' (removed {removed} keys).")
 
+# Bumped on every write/reload; caches that must not go stale key on it instead of a TTL.
+data_version = 0
+
+def bump_data_version():
+    global data_version
+    data_version += 1
+
+# Writes NOTIFY every worker (this one included) so their caches and versions move too.
+WORKER_ID = uuid.uuid4().hex[:12]
+
+async def notify_sales_changed(session: AsyncSession, changes: list[tuple[str, date, float]]):
+    """
+    Queue a NOTIFY carrying the write's (category, order_date, sales delta)
+    changes in the current transaction; Postgres delivers it on commit.
+    """
+    payload = anomaly.write_payload(WORKER_ID, changes)
+    await session.execute(select(func.pg_notify("sales_changes", payload)))
+
 # --------------------------------------------------
 # Pydantic models
 # --------------------------------------------------
@@ -143,11 +180,120 @@ class SaleUpdate(BaseModel):
 # --------------------------------------------------
 async def notify_handler(conn, pid, channel, payload):
     logger.info(f"🔔 DB Notification: {payload}")
+    write = anomaly.parse_write_payload(payload)
+    if write is not None:
+        worker, changes = write
+        # Every worker, the writer included, feeds its detector from here so all see every write.
+        events = detector.apply(changes)
+        if events:
+            asyncio.create_task(broadcast_anomalies(events))
+        if worker == WORKER_ID:
+            return  # caches already cleared inline by the write handler
     clear_cache(prefix="dashboard:")
+    bump_data_version()
+    if payload == "reload":
+        # Bulk reload replaced the table wholesale; incremental state no longer applies.
+        asyncio.create_task(reseed_detector())
     asyncio.create_task(broadcast_data_update())
 
+# --------------------------------------------------
+# Startup warm-up / readiness
+# --------------------------------------------------
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Comma-separated categories to warm, or "*" for every category in the DB.
+WARMUP_CATEGORIES = os.getenv("WARMUP_CATEGORIES", "All")
+WARMUP_PRELOAD_MODELS = os.getenv("WARMUP_PRELOAD_MODELS", "true").lower() in ("1", "true", "yes")
+
+startup_state = {
+    "started": False,
+    "import_seconds": None,
+    "warmup_seconds": None,
+    "startup_seconds": None,
+    "models_loaded": [],
+    "dashboards_primed": [],
+    "errors": [],
+}
+
+# LISTEN connection; readiness depends on it staying open.
+_listen_conn: Optional[asyncpg.Connection] = None
+_reprime_task: Optional[asyncio.Task] = None
+
+async def prime_dashboards(categories: list[str]) -> tuple[list[str], list[str]]:
+    """Compute and cache dashboard data for each category; returns (primed, errors)."""
+    primed, errors = [], []
+    async with AsyncSessionLocal() as session:
+        for category in categories:
+            try:
+                await get_dashboard_data(category=category, session=session)
+                primed.append(category)
+            except Exception as e:
+                logger.error(f"Priming dashboard '{category}' failed: {e}")
+                errors.append(f"dashboard:{category}: {e}")
+    return primed, errors
+
+async def reprime_loop(categories: list[str]):
+    """Re-prime warmed dashboards in the background as their CACHE_TTL entries expire."""
+    while True:
+        await asyncio.sleep(CACHE_TTL / 2)
+        expired = [c for c in categories if get_cache(f"dashboard:{c}") is None]
+        if expired:
+            try:
+                await prime_dashboards(expired)
+            except Exception as e:
+                logger.error(f"Dashboard re-prime failed: {e}")
+
+async def warmup():
+    """Pre-load saved models and prime the dashboard cache before reporting ready."""
+    global _reprime_task
+    try:
+        if WARMUP_CATEGORIES.strip() == "*":
+            async with AsyncSessionLocal() as session:
+                categories = (await get_categories(session))["categories"]
+        else:
+            categories = [c.strip() for c in WARMUP_CATEGORIES.split(",") if c.strip()]
+        primed, errors = await prime_dashboards(categories)
+        startup_state["errors"] += errors
+    except Exception as e:
+        # A failed warm-up must not stop the worker from starting; /ready reports it.
+        logger.error(f"Warm-up failed: {e}")
+        startup_state["errors"].append(f"warmup: {e}")
+        return
+    startup_state["dashboards_primed"] = primed
+    if primed:
+        _reprime_task = asyncio.create_task(reprime_loop(primed))
+
+    if not WARMUP_PRELOAD_MODELS:
+        return
+    to_load = [c for c in categories if os.path.exists(forecasting.model_path_for(c))]
+    if not to_load:
+        return
+    try:
+        # Unpickling a Prophet model imports prophet/cmdstan; keep it off the event loop.
+        await asyncio.to_thread(forecasting.import_forecasting_deps)
+    except Exception as e:
+        logger.error(f"Warm-up import of forecasting deps failed: {e}")
+        startup_state["errors"].append(f"imports: {e}")
+        return
+    for category in to_load:
+        try:
+            await asyncio.to_thread(forecasting.load_model, category)
+            startup_state["models_loaded"].append(category)
+        except Exception as e:
+            logger.error(f"Warm-up model '{category}' failed: {e}")
+            startup_state["errors"].append(f"model:{category}: {e}")
+
+def readiness() -> dict:
+    checks = {
+        "startup_complete": startup_state["started"],
+        "listener_connected": _listen_conn is not None and not _listen_conn.is_closed(),
+        "warmup_ok": not startup_state["errors"],
+    }
+    return {"ready": all(checks.values()), "checks": checks}
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _listen_conn
+    lifespan_started = time.perf_counter()
     conn = await asyncpg.connect(
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
@@ -156,10 +302,28 @@ async def lifespan(app: FastAPI):
         port=int(os.getenv("DB_PORT", 5432))
     )
     await conn.add_listener("sales_changes", notify_handler)
+    _listen_conn = conn
     logger.info("✅ Listening for Postgres NOTIFY events...")
+    await reseed_detector()
+
+    if WARMUP_ENABLED:
+        warmup_started = time.perf_counter()
+        await warmup()
+        startup_state["warmup_seconds"] = round(time.perf_counter() - warmup_started, 3)
+    startup_state["startup_seconds"] = round(time.perf_counter() - lifespan_started, 3)
+    startup_state["started"] = True
+    scheduler.start()
+    logger.info(
+        f"🚀 Ready: imports {startup_state['import_seconds']}s, "
+        f"warm-up {startup_state['warmup_seconds']}s, startup {startup_state['startup_seconds']}s"
+    )
 
     yield
 
+    startup_state["started"] = False
+    if _reprime_task is not None:
+        _reprime_task.cancel()
+    await scheduler.stop()
     await conn.close()
     logger.info("🛑 DB connection closed.")
 
@@ -191,13 +355,6 @@ async def websocket_endpoint(websocket: WebSocket):
 # --------------------------------------------------
 # Helpers
 # --------------------------------------------------
-MODELS_DIR = "models"
-os.makedirs(MODELS_DIR, exist_ok=True)
-
-def model_path_for(category: str) -> str:
-    safe = (category or "All").replace(" ", "_").replace("/", "_")
-    return os.path.join(MODELS_DIR, f"prophet_sales_{safe}.pkl")
-
 async def load_df(session: AsyncSession) -> pd.DataFrame:
     stmt = select(Sale)
     res = await session.execute(stmt)
@@ -230,6 +387,19 @@ async def monthly_series(session: AsyncSession, category: str | None):
         df['ds'] = df['ds'].dt.tz_localize(None)
     return df
 
+async def training_series(session: AsyncSession, category: str | None):
+    """Monthly series cleaned for Prophet (naive datetimes, no gaps)."""
+    ts = await monthly_series(session, category)
+    ts['ds'] = pd.to_datetime(ts['ds']).dt.tz_localize(None)
+    return ts.dropna()
+
+async def forecast_categories(session: AsyncSession) -> list[str]:
+    return (await get_categories(session))["categories"]
+
+scheduler = retrain.RetrainScheduler(
+    AsyncSessionLocal, engine, forecast_categories, training_series, manager.broadcast
+)
+
 # --------------------------------------------------
 # Routes
 # --------------------------------------------------
@@ -288,14 +458,83 @@ async def get_dashboard_data(
     set_cache(f"dashboard:{category}", data)
     return data
 
+# ---------------- CUSTOMERS ---------------- #
+async def _rfm_table(session, category, login_type, device_type):
+    key = f"rfm:{category}:{login_type}:{device_type}"
+    table = customer_analytics.get_cached(data_version, key)
+    if table is None:
+        version = data_version
+        table = await customer_analytics.rfm_table(session, category, login_type, device_type)
+        customer_analytics.set_cached(version, key, table)
+    return table
+
+async def _cohort_activity(session, category, login_type, device_type):
+    key = f"cohorts:{category}:{login_type}:{device_type}"
+    activity = customer_analytics.get_cached(data_version, key)
+    if activity is None:
+        version = data_version
+        activity = await customer_analytics.cohort_activity(session, category, login_type, device_type)
+        customer_analytics.set_cached(version, key, activity)
+    return activity
+
+@app.get("/customers/segments")
+async def get_customer_segments(
+    category: str = Query("All"),
+    login_type: Optional[str] = Query(None),
+    device_type: Optional[str] = Query(None),
+    session: AsyncSession = Depends(get_session)
+):
+    table = await _rfm_table(session, category, login_type, device_type)
+    return {"category": category, **customer_analytics.rfm_summary(table)}
+
+@app.get("/customers/rfm")
+async def get_customer_rfm(
+    category: str = Query("All"),
+    login_type: Optional[str] = Query(None),
+    device_type: Optional[str] = Query(None),
+    segment: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_session)
+):
+    if segment and segment not in customer_analytics.SEGMENTS:
+        raise HTTPException(status_code=400, detail=f"Unknown segment '{segment}'")
+    table = await _rfm_table(session, category, login_type, device_type)
+    customers = customer_analytics.rfm_customers(table, segment, limit, offset)
+    return {"category": category, "segment": segment, "offset": offset, "customers": customers}
+
+@app.get("/customers/cohorts")
+async def get_customer_cohorts(
+    category: str = Query("All"),
+    login_type: Optional[str] = Query(None),
+    device_type: Optional[str] = Query(None),
+    max_months: int = Query(12, ge=1, le=120),
+    session: AsyncSession = Depends(get_session)
+):
+    activity = await _cohort_activity(session, category, login_type, device_type)
+    return {"category": category, "cohorts": customer_analytics.cohorts_summary(activity, max_months)}
+
+@app.get("/customers/retention")
+async def get_customer_retention(
+    category: str = Query("All"),
+    login_type: Optional[str] = Query(None),
+    device_type: Optional[str] = Query(None),
+    max_months: int = Query(12, ge=1, le=120),
+    session: AsyncSession = Depends(get_session)
+):
+    activity = await _cohort_activity(session, category, login_type, device_type)
+    return {"category": category, **customer_analytics.retention_matrix(activity, max_months)}
+
 # ---------------- ROUTES (WRITE) ---------------- #
 @app.post("/sales", status_code=201)
 async def create_sale(payload: SaleCreate, session: AsyncSession = Depends(get_session)):
     sale = Sale(**payload.dict())
     session.add(sale)
+    await notify_sales_changed(session, [(sale.product_category, sale.order_date, sale.sales)])
     await session.commit()
     await session.refresh(sale)
     clear_cache(prefix="dashboard:")
+    bump_data_version()
     await broadcast_data_update()
     return {"status": "ok", "id": sale.id}
 
@@ -308,11 +547,18 @@ async def update_sale(
     sale = await session.get(Sale, sale_id)
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
+    before = (sale.product_category, sale.order_date, sale.sales)
     data = payload.dict(exclude_unset=True)
     for k, v in data.items():
         setattr(sale, k, v)
+    after = (sale.product_category, sale.order_date, sale.sales)
+    changes = []
+    if after != before:
+        changes = [(before[0], before[1], -before[2]), after]
+    await notify_sales_changed(session, changes)
     await session.commit()
     clear_cache(prefix="dashboard:")
+    bump_data_version()
     await broadcast_data_update()
     return {"status": "ok", "id": sale_id}
 
@@ -322,8 +568,10 @@ async def delete_sale(sale_id: int, session: AsyncSession = Depends(get_session)
     if not sale:
         raise HTTPException(status_code=404, detail="Sale not found")
     await session.delete(sale)
+    await notify_sales_changed(session, [(sale.product_category, sale.order_date, -sale.sales)])
     await session.commit()
     clear_cache(prefix="dashboard:")
+    bump_data_version()
     await broadcast_data_update()
     return {"status": "ok", "deleted": sale_id}
 
@@ -335,7 +583,7 @@ async def train_forecast(
     session: AsyncSession = Depends(get_session)
 ):
     ts = await monthly_series(session, category)
-    if len(ts) < 6:
+    if len(ts) < forecasting.MIN_TRAIN_MONTHS:
         raise HTTPException(status_code=400, detail="Not enough monthly data to train (need >=6 months).")
     background_tasks.add_task(train_model_background, category)
     return {"status": "training_queued", "category": category}
@@ -346,36 +594,59 @@ async def predict(
     category: str = Query("All"),
     session: AsyncSession = Depends(get_session)
 ):
-    ts = await monthly_series(session, category)
+    ts = await training_series(session, category)
     if ts.empty:
         raise HTTPException(status_code=404, detail="No data for requested category")
-    ts['ds'] = pd.to_datetime(ts['ds']).dt.tz_localize(None)
-    ts = ts.dropna()
 
-    path = model_path_for(category)
-    if os.path.exists(path):
-        model = joblib.load(path)
-    else:
-        if len(ts) < 6:
+    # The first load also imports prophet/cmdstan; keep both it and the predict off the event loop.
+    model = await asyncio.to_thread(forecasting.load_model, category)
+    if model is None:
+        if len(ts) < forecasting.MIN_TRAIN_MONTHS:
             raise HTTPException(status_code=400, detail="Not enough data to train")
-        model = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False)
-        model.fit(ts)
-        joblib.dump(model, path)
+        await scheduler.ensure_model(category, ts)
+        model = await asyncio.to_thread(forecasting.load_model, category)
 
-    future = model.make_future_dataframe(periods=horizon, freq="MS")
-    forecast = model.predict(future)
-    out = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].copy()
-    actuals = ts.set_index("ds")["y"]
-    out["actual"] = actuals.reindex(out["ds"]).values
-    out = out.replace({np.nan: None})
-    out["ds"] = pd.to_datetime(out["ds"]).dt.strftime("%Y-%m-%d")
+    out = await asyncio.to_thread(forecasting.forecast_frame, model, ts, horizon)
+    series = out.to_dict(orient="records")
+    detector.set_forecast(category, series)
 
-    return {"category": category, "horizon": horizon, "series": out.to_dict(orient="records")}
+    return {"category": category, "horizon": horizon, "series": series}
+
+@app.get("/retrain/status")
+async def retrain_status():
+    return scheduler.status()
+
+@app.get("/retrain/plan")
+async def retrain_plan():
+    plan = await scheduler.plan()
+    return {"plan": [{k: v for k, v in item.items() if k != "ts"} for item in plan]}
+
+@app.post("/retrain/run")
+async def retrain_run(background_tasks: BackgroundTasks):
+    if scheduler.running:
+        raise HTTPException(status_code=409, detail="A retrain run is already in progress")
+    background_tasks.add_task(scheduler.run_once)
+    return {"status": "retrain_queued"}
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "active_websocket_connections": len(manager.active_connections)}
 
+@app.get("/anomalies/state")
+async def anomaly_state():
+    return {
+        "z_threshold": anomaly.ANOMALY_Z_THRESHOLD,
+        "alpha": anomaly.ANOMALY_ALPHA,
+        "forecast_categories": sorted(detector.forecasts),
+        "series": detector.state(),
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    state = readiness()
+    status_code = 200 if state["ready"] else 503
+    return JSONResponse(status_code=status_code, content={**state, **startup_state})
+
 # ---------------- Background Training ---------------- #
 async def train_model_background(category: str):
     try:
@@ -385,24 +656,20 @@ async def train_model_background(category: str):
             "message": f"Training started for {category}"
         })
         async with AsyncSessionLocal() as session:
-            ts = await monthly_series(session, category)
-            if ts.empty or len(ts) < 6:
+            ts = await training_series(session, category)
+            if ts.empty or len(ts) < forecasting.MIN_TRAIN_MONTHS:
                 await manager.broadcast({
                     "status": "training_failed",
                     "category": category,
                     "error": "Not enough data"
                 })
                 return
-            ts['ds'] = pd.to_datetime(ts['ds']).dt.tz_localize(None)
-            ts = ts.dropna()
-            m = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False, uncertainty_samples=100)
-            m.fit(ts)
-            p = model_path_for(category)
-            joblib.dump(m, p)
+            fit = await scheduler.refit(category, ts, uncertainty_samples=100)
             await manager.broadcast({
                 "status": "training_completed",
                 "category": category,
-                "months_trained": len(ts)
+                "months_trained": len(ts),
+                **fit
             })
     except Exception as e:
         logger.error(f"Background training failed: {e}")
@@ -411,3 +678,5 @@ async def train_model_background(category: str):
             "category": category,
             "error": str(e)
         })
+
+startup_state["import_seconds"] = round(time.perf_counter() - _import_started, 3)
@@ -0,0 +1,283 @@
+# customer_analytics.py
+import numpy as np
+from datetime import date
+from sqlalchemy import select, func, literal, Integer, Date
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Sale
+
+# --------------------------------------------------
+# Config
+# --------------------------------------------------
+RFM_BINS = 5
+# Filters are free-form query params, so bound how many variants one version keeps.
+CACHE_MAX_ENTRIES = 32
+
+# Results are keyed on the data version, not a TTL: they stay valid until the
+# next write/reload bumps the version, at which point everything is dropped.
+_results = {}
+_results_version = None
+
+def get_cached(version: int, key: str):
+    if _results_version != version:
+        return None
+    return _results.get(key)
+
+def set_cached(version: int, key: str, value):
+    global _results_version
+    if _results_version != version:
+        _results.clear()
+        _results_version = version
+    _results.pop(key, None)
+    while len(_results) >= CACHE_MAX_ENTRIES:
+        _results.pop(next(iter(_results)))
+    _results[key] = value
+
+# --------------------------------------------------
+# Query helpers
+# --------------------------------------------------
+def _filtered(stmt, category: str | None, login_type: str | None, device_type: str | None):
+    if category and category != "All":
+        stmt = stmt.where(Sale.product_category == category)
+    if login_type:
+        stmt = stmt.where(Sale.customer_login_type == login_type)
+    if device_type:
+        stmt = stmt.where(Sale.device_type == device_type)
+    return stmt
+
+def _month_index(col):
+    """year * 12 + (month - 1) as an integer, so months compare and subtract as plain ints."""
+    return (
+        func.extract("year", col) * 12 + func.extract("month", col) - 1
+    ).cast(Integer)
+
+def _month_label(idx: int) -> str:
+    return f"{idx // 12:04d}-{idx % 12 + 1:02d}"
+
+def _columns(rows, dtypes):
+    """Transpose result rows into one NumPy array per column."""
+    cols = list(zip(*rows))
+    return [np.asarray(c, dtype=d) for c, d in zip(cols, dtypes)]
+
+# --------------------------------------------------
+# RFM
+# --------------------------------------------------
+def _bin_scores(values: np.ndarray, bins: int = RFM_BINS) -> np.ndarray:
+    """
+    Quantile score 1..bins from the share of values strictly below each value
+    (SQL percent_rank). Tied values share a score set by where their group
+    starts, so a large block of one-order customers scores 1, not 4.
+    """
+    if values.size == 0:
+        return values.astype(np.int8)
+    ordered = np.sort(values)
+    pct = np.searchsorted(ordered, values, side="left") / values.size
+    return np.clip(np.floor(pct * bins) + 1, 1, bins).astype(np.int8)
+
+SEGMENTS = [
+    "Champions", "Loyal", "Potential Loyalist", "New", "At Risk",
+    "Can't Lose", "Hibernating", "Lost",
+]
+
+def _segment(r: np.ndarray, f: np.ndarray, m: np.ndarray) -> np.ndarray:
+    fm = (f.astype(np.int16) + m) / 2
+    conditions = [
+        (r >= 4) & (fm >= 4),
+        (r >= 3) & (fm >= 3),
+        (r >= 4) & (fm >= 2),
+        (r >= 4),
+        (r == 2) & (fm >= 3),
+        (r == 1) & (fm >= 4),
+        (r >= 2),
+    ]
+    codes = np.select(conditions, np.arange(len(conditions)), default=len(SEGMENTS) - 1)
+    return codes.astype(np.int8)
+
+async def rfm_table(
+    session: AsyncSession,
+    category: str | None = None,
+    login_type: str | None = None,
+    device_type: str | None = None,
+) -> dict | None:
+    """Per-customer RFM arrays: one aggregate row per customer from SQL, scored in NumPy."""
+    day = (Sale.order_date - literal(date(1970, 1, 1), Date)).label("day")
+    stmt = _filtered(
+        select(
+            Sale.customer_id,
+            func.max(day),
+            func.count(),
+            func.sum(Sale.sales),
+        ).group_by(Sale.customer_id),
+        category, login_type, device_type,
+    )
+    rows = (await session.execute(stmt)).all()
+    if not rows:
+        return None
+
+    customer_id, last_day, frequency, monetary = _columns(
+        rows, (np.int64, np.int32, np.int32, np.float64)
+    )
+    as_of = int(last_day.max()) + 1
+    recency = as_of - last_day
+    # Fewer days since the last order is better, so invert the recency bins.
+    r = (RFM_BINS + 1 - _bin_scores(recency)).astype(np.int8)
+    f = _bin_scores(frequency)
+    m = _bin_scores(monetary)
+    return {
+        "as_of": as_of,
+        "customer_id": customer_id,
+        "recency": recency,
+        "frequency": frequency,
+        "monetary": monetary,
+        "r": r, "f": f, "m": m,
+        "segment": _segment(r, f, m),
+    }
+
+def rfm_summary(table: dict | None) -> dict:
+    if table is None:
+        return {"as_of": None, "customers": 0, "segments": [], "scores": {}}
+    seg, monetary, recency = table["segment"], table["monetary"], table["recency"]
+    seg_counts = np.bincount(seg, minlength=len(SEGMENTS))
+    seg_revenue = np.bincount(seg, weights=monetary, minlength=len(SEGMENTS))
+    seg_recency = np.bincount(seg, weights=recency, minlength=len(SEGMENTS))
+    segments = [
+        {
+            "segment": SEGMENTS[i],
+            "customers": int(seg_counts[i]),
+            "revenue": round(float(seg_revenue[i]), 2),
+            "avg_recency_days": round(float(seg_recency[i] / seg_counts[i]), 1),
+        }
+        for i in range(len(SEGMENTS)) if seg_counts[i]
+    ]
+    scores = {
+        name: np.bincount(table[name], minlength=RFM_BINS + 1)[1:].tolist()
+        for name in ("r", "f", "m")
+    }
+    return {
+        "as_of": str(np.datetime64(table["as_of"], "D")),
+        "customers": int(seg.size),
+        "segments": segments,
+        "scores": scores,
+    }
+
+def rfm_customers(table: dict | None, segment: str | None, limit: int, offset: int) -> list[dict]:
+    """Page through per-customer RFM rows, highest spend first."""
+    if table is None:
+        return []
+    customer_id, recency, frequency, monetary = (
+        table["customer_id"], table["recency"], table["frequency"], table["monetary"]
+    )
+    r, f, m, seg = table["r"], table["f"], table["m"], table["segment"]
+    idx = np.argsort(-monetary, kind="stable")
+    if segment:
+        if segment not in SEGMENTS:
+            return []
+        idx = idx[seg[idx] == SEGMENTS.index(segment)]
+    idx = idx[offset:offset + limit]
+    return [
+        {
+            "customer_id": int(customer_id[i]),
+            "recency_days": int(recency[i]),
+            "frequency": int(frequency[i]),
+            "monetary": round(float(monetary[i]), 2),
+            "r": int(r[i]), "f": int(f[i]), "m": int(m[i]),
+            "segment": SEGMENTS[seg[i]],
+        }
+        for i in idx
+    ]
+
+# --------------------------------------------------
+# Cohorts / retention
+# --------------------------------------------------
+async def cohort_activity(
+    session: AsyncSession,
+    category: str | None = None,
+    login_type: str | None = None,
+    device_type: str | None = None,
+) -> dict:
+    """
+    Customer activity folded into cohort x month-offset matrices. Postgres
+    builds one row per (customer, active month), attaches the acquisition
+    month with a window function and aggregates again by (cohort, month), so
+    only about n_cohorts x width rows come back.
+    """
+    month = _month_index(Sale.order_date).label("month")
+    active = _filtered(
+        select(
+            Sale.customer_id.label("customer_id"),
+            month,
+            func.sum(Sale.sales).label("sales"),
+        ).group_by(Sale.customer_id, month),
+        category, login_type, device_type,
+    ).subquery()
+    windowed = select(
+        func.min(active.c.month).over(partition_by=active.c.customer_id).label("cohort"),
+        active.c.month,
+        active.c.sales,
+    ).subquery()
+    stmt = select(
+        windowed.c.cohort,
+        windowed.c.month,
+        func.count(),
+        func.sum(windowed.c.sales),
+    ).group_by(windowed.c.cohort, windowed.c.month)
+    rows = (await session.execute(stmt)).all()
+    if not rows:
+        return {"first_month": None, "last_month": None, "sizes": None, "active": None, "revenue": None}
+    return cohort_matrices(*_columns(rows, (np.int32, np.int32, np.int64, np.float64)))
+
+def cohort_matrices(
+    cohort_month: np.ndarray, month: np.ndarray, customers: np.ndarray, sales: np.ndarray
+) -> dict:
+    """Scatter (cohort, month, active customers, sales) rows into dense matrices."""
+    first = int(cohort_month.min())
+    n_cohorts = int(cohort_month.max()) - first + 1
+    offset = month - cohort_month
+    width = int(offset.max()) + 1
+    flat = (cohort_month - first) * width + offset
+    size = n_cohorts * width
+    active_counts = np.bincount(flat, weights=customers, minlength=size).astype(np.int64).reshape(n_cohorts, width)
+    revenue = np.bincount(flat, weights=sales, minlength=size).reshape(n_cohorts, width)
+    return {
+        "first_month": first,
+        "last_month": int(month.max()),
+        # Every customer is active in their acquisition month, so column 0 is the cohort size.
+        "sizes": active_counts[:, 0].copy(),
+        "active": active_counts,
+        "revenue": revenue,
+    }
+
+def cohorts_summary(activity: dict, max_offset: int) -> list[dict]:
+    if activity["sizes"] is None:
+        return []
+    first, sizes, revenue = activity["first_month"], activity["sizes"], activity["revenue"]
+    out = []
+    for i in np.flatnonzero(sizes):
+        out.append({
+            "cohort": _month_label(first + int(i)),
+            "new_customers": int(sizes[i]),
+            "revenue_by_month": np.round(revenue[i, :max_offset + 1], 2).tolist(),
+            "lifetime_revenue": round(float(revenue[i].sum()), 2),
+        })
+    return out
+
+def retention_matrix(activity: dict, max_offset: int) -> dict:
+    if activity["sizes"] is None:
+        return {"months": [], "rows": []}
+    first, sizes, active = activity["first_month"], activity["sizes"], activity["active"]
+    keep = np.flatnonzero(sizes)
+    counts = active[keep, :max_offset + 1]
+    rates = counts / sizes[keep, None]
+    # Offsets past the last month in the data have not happened yet for that cohort.
+    last_offset = (activity["last_month"] - first) - keep
+    observed = np.arange(counts.shape[1])[None, :] <= last_offset[:, None]
+    rows = []
+    for j, i in enumerate(keep):
+        n = int(observed[j].sum())
+        rows.append({
+            "cohort": _month_label(first + int(i)),
+            "size": int(sizes[i]),
+            "retained": counts[j, :n].tolist(),
+            "retention": np.round(rates[j, :n], 4).tolist(),
+        })
+    return {"months": list(range(counts.shape[1])), "rows": rows}
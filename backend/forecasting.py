@@ -0,0 +1,122 @@
+# forecasting.py
+import os
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------
+# Config
+# --------------------------------------------------
+# Prophet (and the cmdstan backend it pulls in) and joblib are only imported
+# the first time a forecast is fitted or a model is loaded, so workers that
+# only serve dashboard/CRUD traffic never pay for them.
+MODELS_DIR = "models"
+os.makedirs(MODELS_DIR, exist_ok=True)
+
+MIN_TRAIN_MONTHS = 6
+
+# category -> (model, mtime of the .pkl it was loaded from)
+_models = {}
+
+def model_path_for(category: str) -> str:
+    safe = (category or "All").replace(" ", "_").replace("/", "_")
+    return os.path.join(MODELS_DIR, f"prophet_sales_{safe}.pkl")
+
+# --------------------------------------------------
+# Lazy heavy imports
+# --------------------------------------------------
+def _prophet_cls():
+    from prophet import Prophet  # type: ignore
+    return Prophet
+
+def _joblib():
+    import joblib
+    return joblib
+
+def import_forecasting_deps():
+    """Import Prophet and joblib eagerly (used by the startup warm-up)."""
+    _prophet_cls()
+    _joblib()
+
+# --------------------------------------------------
+# Model load / fit / save
+# --------------------------------------------------
+def load_model(category: str):
+    """Return the saved model for a category, reusing the in-memory copy until the .pkl changes."""
+    path = model_path_for(category)
+    if not os.path.exists(path):
+        _models.pop(category, None)
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _models.get(category)
+    if cached and cached[1] == mtime:
+        return cached[0]
+    model = _joblib().load(path)
+    _models[category] = (model, mtime)
+    logger.info(f"📦 Loaded model for '{category}' from {path}")
+    return model
+
+def _new_prophet(**kwargs):
+    Prophet = _prophet_cls()
+    return Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False, **kwargs)
+
+def usable_init(ts: pd.DataFrame, init: dict | None, **kwargs) -> dict | None:
+    """
+    Return `init` only if its delta/beta shapes match what a fit on `ts` will use.
+    Prophet silently swaps mismatched inits for its defaults, so the check has to
+    happen here for callers to know whether a fit was actually warm-started.
+    The changepoint count grows with short histories, which is the usual mismatch.
+    """
+    if init is None:
+        return None
+    # preprocess() marks a Prophet instance as fitted, so probe with a throwaway one.
+    inputs = _new_prophet(**kwargs).preprocess(ts)
+    if len(init["delta"]) != inputs.S or len(init["beta"]) != inputs.K:
+        return None
+    return init
+
+def fit_model(ts: pd.DataFrame, init: dict | None = None, **kwargs):
+    """Fit a Prophet model; `init` warm-starts the optimizer from a previous fit's parameters."""
+    m = _new_prophet(**kwargs)
+    if init is not None:
+        m.fit(ts, init=init)
+    else:
+        m.fit(ts)
+    return m
+
+def warm_start_params(model) -> dict:
+    """Point estimates of a fitted model's Stan parameters, usable as `init` for the next fit."""
+    import numpy as np
+
+    res = {}
+    for pname in ("k", "m", "sigma_obs"):
+        if model.mcmc_samples == 0:
+            res[pname] = model.params[pname][0][0]
+        else:
+            res[pname] = np.mean(model.params[pname])
+    for pname in ("delta", "beta"):
+        if model.mcmc_samples == 0:
+            res[pname] = model.params[pname][0]
+        else:
+            res[pname] = np.mean(model.params[pname], axis=0)
+    return res
+
+def save_model(category: str, model) -> str:
+    path = model_path_for(category)
+    _joblib().dump(model, path)
+    _models[category] = (model, os.path.getmtime(path))
+    return path
+
+def forecast_frame(model, ts: pd.DataFrame, horizon: int) -> pd.DataFrame:
+    """Forecast `horizon` months ahead and join the actuals; NaNs become None for JSON."""
+    import numpy as np
+
+    future = model.make_future_dataframe(periods=horizon, freq="MS")
+    forecast = model.predict(future)
+    out = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].copy()
+    actuals = ts.set_index("ds")["y"]
+    out["actual"] = actuals.reindex(out["ds"]).values
+    out = out.replace({np.nan: None})
+    out["ds"] = pd.to_datetime(out["ds"]).dt.strftime("%Y-%m-%d")
+    return out
@@ -0,0 +1,300 @@
+# retrain.py
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+import pandas as pd
+from sqlalchemy import select, func
+
+import forecasting
+
+logger = logging.getLogger(__name__)
+
+# --------------------------------------------------
+# Config
+# --------------------------------------------------
+RETRAIN_INTERVAL_SECONDS = int(os.getenv("RETRAIN_INTERVAL_SECONDS", 3600))  # 0 disables the loop
+# Relative change in an already-trained month's total that counts as a revision.
+RETRAIN_REVISION_THRESHOLD = float(os.getenv("RETRAIN_REVISION_THRESHOLD", 0.02))
+REGISTRY_PATH = os.path.join(forecasting.MODELS_DIR, "registry.json")
+# Postgres advisory lock keys. The single-key lock gates the scheduled pass to
+# one worker; (RETRAIN_LOCK_KEY, hashtext(category)) serializes fits per category
+# across workers. The two forms live in separate lock spaces. REGISTRY_LOCK_KEY
+# guards the registry.json read-modify-write.
+RETRAIN_LOCK_KEY = 0x52455452  # "RETR"
+REGISTRY_LOCK_KEY = RETRAIN_LOCK_KEY + 1
+
+# --------------------------------------------------
+# Series fingerprints
+# --------------------------------------------------
+def series_snapshot(ts: pd.DataFrame, today: date) -> dict[str, float]:
+    """Completed months only: the open calendar month is still accumulating sales."""
+    current_month = today.replace(day=1).isoformat()
+    snapshot = {d.strftime("%Y-%m-%d"): round(float(y), 2) for d, y in zip(ts["ds"], ts["y"])}
+    return {m: y for m, y in snapshot.items() if m < current_month}
+
+def fingerprint(snapshot: dict[str, float]) -> str:
+    return hashlib.sha1(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()[:12]
+
+def decide(snapshot: dict[str, float], entry: dict | None, has_model: bool) -> tuple[str, str]:
+    """
+    Return ("refit" | "skip", reason) for one category's completed-month
+    snapshot against the one the current model was trained on. Both sides
+    leave out the open month, so a month that was partial at training time
+    shows up as newly completed once it closes.
+    """
+    if len(snapshot) < forecasting.MIN_TRAIN_MONTHS:
+        return "skip", f"only {len(snapshot)} completed months of data"
+    if not has_model:
+        return "refit", "no trained model"
+    if entry is None:
+        return "refit", "model has no recorded training data"
+    if fingerprint(snapshot) == entry["fingerprint"]:
+        return "skip", "series unchanged"
+
+    trained = entry["months"]
+    new_months = sorted(m for m in snapshot if m not in trained)
+    if new_months:
+        return "refit", f"new month(s) completed: {', '.join(new_months)}"
+    removed = sorted(m for m in trained if m not in snapshot)
+    if removed:
+        return "refit", f"month(s) removed: {', '.join(removed)}"
+    for m, y in snapshot.items():
+        old = trained[m]
+        if abs(y - old) / max(abs(old), 1.0) > RETRAIN_REVISION_THRESHOLD:
+            return "refit", f"{m} revised {old} -> {y}"
+    return "skip", "changes within revision threshold"
+
+# --------------------------------------------------
+# Scheduler
+# --------------------------------------------------
+class RetrainScheduler:
+    """
+    Periodically checks every category's monthly series and refits only those
+    whose completed months changed, warm-starting from the previous model.
+    """
+
+    def __init__(self, session_factory, engine, list_categories, monthly_series, notify):
+        self.session_factory = session_factory
+        self.engine = engine
+        self.list_categories = list_categories
+        self.monthly_series = monthly_series
+        self.notify = notify
+        self.registry: dict[str, dict] = self._load_registry()
+        self.decisions = deque(maxlen=200)
+        self.last_run: str | None = None
+        self.next_run: str | None = None
+        self.running = False
+        self.last_outcome: str | None = None
+        self._lock = asyncio.Lock()
+        self._fit_locks: dict[str, asyncio.Lock] = {}
+        self._task: asyncio.Task | None = None
+
+    # ---------------- registry ---------------- #
+    def _load_registry(self) -> dict:
+        if not os.path.exists(REGISTRY_PATH):
+            return {}
+        try:
+            with open(REGISTRY_PATH) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read model registry: {e}")
+            return {}
+
+    def _save_registry(self):
+        # A temp file per writer, so concurrent saves never interleave into one file.
+        fd, tmp = tempfile.mkstemp(dir=forecasting.MODELS_DIR, prefix="registry.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.registry, f, indent=2)
+            os.replace(tmp, REGISTRY_PATH)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    async def record_fit(self, category: str, ts: pd.DataFrame, fit_seconds: float, warm_start: bool):
+        snapshot = series_snapshot(ts, date.today())
+        # Other workers write the same file; merge into its latest contents under
+        # a registry-wide lock so concurrent fits of different categories keep both entries.
+        async with self._advisory_lock(REGISTRY_LOCK_KEY):
+            self.registry = self._load_registry()
+            self.registry[category] = {
+                "fingerprint": fingerprint(snapshot),
+                "months": snapshot,
+                "trained_at": datetime.now().isoformat(timespec="seconds"),
+                "fit_seconds": round(fit_seconds, 3),
+                "warm_start": warm_start,
+            }
+            self._save_registry()
+
+    # ---------------- locking ---------------- #
+    @asynccontextmanager
+    async def _advisory_lock(self, *key, wait: bool = True):
+        """
+        Session-level Postgres advisory lock on a dedicated autocommit connection:
+        no transaction stays open while it is held, and it is released explicitly.
+        Yields whether the lock was acquired (always True when wait=True).
+        """
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            fn = func.pg_advisory_lock if wait else func.pg_try_advisory_lock
+            acquired = bool(await conn.scalar(select(fn(*key))))
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await conn.scalar(select(func.pg_advisory_unlock(*key)))
+
+    @asynccontextmanager
+    async def _fit_lock(self, category: str):
+        # The asyncio lock queues this worker's callers without each holding a DB
+        # connection; the advisory lock then excludes fits in other workers.
+        async with self._fit_locks.setdefault(category, asyncio.Lock()):
+            async with self._advisory_lock(RETRAIN_LOCK_KEY, func.hashtext(category)):
+                yield
+
+    # ---------------- fitting ---------------- #
+    async def refit(self, category: str, ts: pd.DataFrame, **fit_kwargs) -> dict:
+        """Fit and save a model for `category`, warm-starting from the saved one if possible."""
+        # One fit per category at a time across all workers, so the saved .pkl
+        # and its registry entry come from the same fit.
+        async with self._fit_lock(category):
+            return await self._refit(category, ts, **fit_kwargs)
+
+    async def ensure_model(self, category: str, ts: pd.DataFrame, **fit_kwargs):
+        """Fit only if no model exists once any in-flight fit for the category has finished."""
+        async with self._fit_lock(category):
+            if not os.path.exists(forecasting.model_path_for(category)):
+                await self._refit(category, ts, **fit_kwargs)
+
+    async def _refit(self, category: str, ts: pd.DataFrame, **fit_kwargs) -> dict:
+        init = None
+        try:
+            previous = await asyncio.to_thread(forecasting.load_model, category)
+            if previous is not None:
+                init = await asyncio.to_thread(
+                    forecasting.usable_init, ts, forecasting.warm_start_params(previous), **fit_kwargs
+                )
+                if init is None:
+                    logger.info(f"Warm start for '{category}' skipped: parameter shapes changed.")
+        except Exception as e:
+            logger.info(f"Previous model for '{category}' not usable for warm start: {e}")
+            init = None
+        started = time.perf_counter()
+        model = await asyncio.to_thread(forecasting.fit_model, ts, init, **fit_kwargs)
+        fit_seconds = time.perf_counter() - started
+        warm = init is not None
+        forecasting.save_model(category, model)
+        await self.record_fit(category, ts, fit_seconds, warm)
+        return {"fit_seconds": round(fit_seconds, 3), "warm_start": warm}
+
+    # ---------------- scheduling ---------------- #
+    async def plan(self) -> list[dict]:
+        """Decisions for every category without fitting anything."""
+        today = date.today()
+        self.registry = self._load_registry()
+        out = []
+        async with self.session_factory() as session:
+            for category in await self.list_categories(session):
+                ts = await self.monthly_series(session, category)
+                action, reason = decide(
+                    series_snapshot(ts, today),
+                    self.registry.get(category),
+                    os.path.exists(forecasting.model_path_for(category)),
+                )
+                out.append({"category": category, "action": action, "reason": reason, "ts": ts})
+        return out
+
+    async def run_once(self) -> list[dict]:
+        # Every worker runs the loop; the advisory lock lets one of them do the pass
+        # and the rest skip it.
+        async with self._lock, self._advisory_lock(RETRAIN_LOCK_KEY, wait=False) as acquired:
+            if not acquired:
+                self.last_outcome = "skipped: another worker is running the retrain pass"
+                logger.info("🔁 Retrain pass skipped; another worker holds the lock.")
+                return []
+            self.running = True
+            try:
+                results = []
+                for item in await self.plan():
+                    ts = item.pop("ts")
+                    item["at"] = datetime.now().isoformat(timespec="seconds")
+                    if item["action"] == "refit":
+                        await self.notify({
+                            "status": "training_started",
+                            "category": item["category"],
+                            "message": f"Scheduled retrain for {item['category']}: {item['reason']}"
+                        })
+                        try:
+                            item.update(await self.refit(item["category"], ts, uncertainty_samples=100))
+                            await self.notify({
+                                "status": "training_completed",
+                                "category": item["category"],
+                                "months_trained": len(ts)
+                            })
+                        except Exception as e:
+                            logger.error(f"Scheduled retrain for '{item['category']}' failed: {e}")
+                            item["action"] = "failed"
+                            item["error"] = str(e)
+                            await self.notify({
+                                "status": "training_failed",
+                                "category": item["category"],
+                                "error": str(e)
+                            })
+                    self.decisions.append(item)
+                    results.append(item)
+                self.last_run = datetime.now().isoformat(timespec="seconds")
+                refits = sum(r["action"] == "refit" for r in results)
+                self.last_outcome = f"{refits} refit, {len(results) - refits} skipped/failed"
+                logger.info(f"🔁 Retrain check: {refits} refit, {len(results) - refits} skipped/failed.")
+                return results
+            finally:
+                self.running = False
+
+    async def _loop(self):
+        while True:
+            self.next_run = datetime.fromtimestamp(time.time() + RETRAIN_INTERVAL_SECONDS).isoformat(timespec="seconds")
+            await asyncio.sleep(RETRAIN_INTERVAL_SECONDS)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Retrain scheduler run failed: {e}")
+
+    def start(self):
+        if RETRAIN_INTERVAL_SECONDS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"⏱️ Retrain scheduler every {RETRAIN_INTERVAL_SECONDS}s.")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.next_run = None
+
+    def status(self) -> dict:
+        self.registry = self._load_registry()
+        return {
+            "enabled": self._task is not None,
+            "interval_seconds": RETRAIN_INTERVAL_SECONDS,
+            "revision_threshold": RETRAIN_REVISION_THRESHOLD,
+            "running": self.running,
+            "last_run": self.last_run,
+            "last_outcome": self.last_outcome,
+            "next_run": self.next_run,
+            "models": {
+                cat: {k: v for k, v in entry.items() if k != "months"} | {"months_trained": len(entry["months"])}
+                for cat, entry in self.registry.items()
+            },
+            "recent_decisions": list(self.decisions)[::-1],
+        }
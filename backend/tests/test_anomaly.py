@@ -0,0 +1,160 @@
+from datetime import date, timedelta
+
+import anomaly
+from anomaly import StreamingDetector, next_bucket
+
+START = date(2024, 1, 1)
+
+
+def _seeded(days=30, value=100.0):
+    d = StreamingDetector()
+    # Small wobble so the deviation estimate is non-zero.
+    history = [(START + timedelta(i), value + (5 if i % 2 else -5)) for i in range(days)]
+    d.seed("A", "day", history)
+    return d
+
+
+def _kinds(events, granularity="day", category="A"):
+    return [(e["kind"], e["period"]) for e in events
+            if e["granularity"] == granularity and e["category"] == category]
+
+
+def test_next_bucket():
+    assert next_bucket("day", date(2024, 2, 28)) == date(2024, 2, 29)
+    assert next_bucket("month", date(2024, 12, 1)) == date(2025, 1, 1)
+    assert next_bucket("month", date(2024, 1, 1)) == date(2024, 2, 1)
+
+
+def test_seed_leaves_last_period_open():
+    d = _seeded()
+    s = d.series[("A", "day")]
+    assert s.bucket == START + timedelta(29)
+    assert s.n == 29
+
+
+def test_spike_flagged_once_while_open():
+    d = _seeded()
+    day = START + timedelta(29)
+    first = d.record("A", day, 1000.0)
+    assert ("spike", day.isoformat()) in _kinds(first)
+    again = d.record("A", day, 1000.0)
+    assert "spike" not in [k for k, _ in _kinds(again)]
+
+
+def test_normal_write_raises_nothing():
+    d = _seeded()
+    assert _kinds(d.record("A", START + timedelta(30), 5.0)) == []
+
+
+def test_gap_days_count_as_zero_and_raise_drops():
+    d = _seeded()
+    last = START + timedelta(29)
+    d.record("A", last, 0.0)
+    events = d.record("A", last + timedelta(10), 100.0)
+    drops = [p for k, p in _kinds(events) if k == "drop"]
+    assert (last + timedelta(1)).isoformat() in drops
+    s = d.series[("A", "day")]
+    # 29 seeded closes + the open day + 9 empty days
+    assert s.n == 29 + 1 + 9
+    assert s.bucket == last + timedelta(10)
+
+
+def test_gap_longer_than_cap_resets_instead_of_alerting():
+    d = _seeded()
+    far = START + timedelta(29 + anomaly.ANOMALY_MAX_GAP_PERIODS + 10)
+    events = d.record("A", far, 100.0, today=far)
+    assert _kinds(events) == []
+    s = d.series[("A", "day")]
+    assert (s.bucket, s.n, s.total) == (far, 0, 100.0)
+    # An ordinary sale right after the reset is not a spike either.
+    assert _kinds(d.record("A", far, 900.0, today=far)) == []
+
+
+def test_gap_at_cap_still_folds_zeros():
+    d = _seeded()
+    before = d.series[("A", "day")].n
+    target = START + timedelta(29 + anomaly.ANOMALY_MAX_GAP_PERIODS + 1)
+    d.record("A", target, 100.0, today=target)
+    assert d.series[("A", "day")].n == before + 1 + anomaly.ANOMALY_MAX_GAP_PERIODS
+
+
+def test_future_dated_write_is_ignored():
+    d = _seeded()
+    today = START + timedelta(29)
+    assert d.record("A", date(2030, 1, 1), 100.0, today=today) == []
+    assert d.series[("A", "day")].bucket == today
+    # Real writes keep being counted afterwards.
+    events = d.record("A", today, 5000.0, today=today)
+    assert ("spike", today.isoformat()) in _kinds(events)
+
+
+def test_periods_between():
+    assert anomaly.periods_between("day", date(2024, 1, 1), date(2024, 1, 2)) == 0
+    assert anomaly.periods_between("day", date(2024, 1, 1), date(2024, 1, 11)) == 9
+    assert anomaly.periods_between("month", date(2023, 11, 1), date(2024, 2, 1)) == 2
+
+
+def test_seed_fills_gaps_with_zeros():
+    d = StreamingDetector()
+    d.seed("A", "day", [(START, 100.0), (START + timedelta(3), 100.0)])
+    s = d.series[("A", "day")]
+    assert s.n == 3
+    assert s.mean < 100.0
+
+
+def test_late_write_is_ignored():
+    d = _seeded()
+    s = d.series[("A", "day")]
+    total, n = s.total, s.n
+    assert _kinds(d.record("A", START, 500.0)) == []
+    assert (s.total, s.n) == (total, n)
+
+
+def test_write_payload_round_trip():
+    changes = [("A", date(2024, 1, 5), 10.5), ("B", date(2024, 1, 6), -3.0)]
+    worker, parsed = anomaly.parse_write_payload(anomaly.write_payload("w1", changes))
+    assert worker == "w1" and parsed == changes
+    assert anomaly.parse_write_payload("reload") is None
+
+
+def test_detectors_fed_through_notifications_agree():
+    # Two workers take interleaved writes; each notification reaches both.
+    today = START + timedelta(40)
+    w1, w2, direct = _seeded(), _seeded(), _seeded()
+    writes = [
+        ("w1", [("A", START + timedelta(29), 120.0)]),
+        ("w2", [("A", START + timedelta(30), 90.0)]),
+        ("w1", [("A", START + timedelta(30), -90.0), ("B", START + timedelta(31), 90.0)]),
+        ("w2", [("A", START + timedelta(33), 2000.0)]),
+    ]
+    seen = {"w1": [], "w2": []}
+    for worker, changes in writes:
+        payload = anomaly.write_payload(worker, changes)
+        for name, det in (("w1", w1), ("w2", w2)):
+            _, parsed = anomaly.parse_write_payload(payload)
+            seen[name] += det.apply(parsed, today=today)
+        direct.apply(changes, today=today)
+    assert w1.state() == w2.state() == direct.state()
+    assert seen["w1"] == seen["w2"]
+    assert any(e["kind"] == "spike" for e in seen["w1"])
+
+
+def test_forecast_band_events():
+    d = StreamingDetector()
+    d.set_forecast("A", [{"ds": "2024-02-01", "yhat": 1000.0, "yhat_lower": 900.0, "yhat_upper": 1100.0}])
+    above = d.record("A", date(2024, 2, 3), 1200.0)
+    assert ("above_forecast", "2024-02-01") in _kinds(above, "month")
+
+    d = StreamingDetector()
+    d.set_forecast("A", [{"ds": "2024-02-01", "yhat": 1000.0, "yhat_lower": 900.0, "yhat_upper": 1100.0}])
+    d.record("A", date(2024, 2, 3), 100.0)
+    below = d.record("A", date(2024, 3, 1), 100.0)
+    assert ("below_forecast", "2024-02-01") in _kinds(below, "month")
+
+
+def test_all_series_tracks_every_category():
+    d = StreamingDetector()
+    d.record("A", START, 10.0)
+    d.record("B", START, 5.0)
+    assert d.series[("All", "day")].total == 15.0
+    assert d.series[("All", "month")].total == 15.0
@@ -0,0 +1,116 @@
+import numpy as np
+
+import customer_analytics as ca
+
+
+def test_bin_scores_heavy_ties_frequency():
+    # 70% one order, 20% two, 7% three, 3% five
+    freq = np.repeat([1, 2, 3, 5], [70, 20, 7, 3])
+    scores = ca._bin_scores(freq)
+    assert set(scores[freq == 1]) == {1}
+    assert set(scores[freq == 2]) == {4}
+    assert set(scores[freq == 3]) == {5}
+    assert set(scores[freq == 5]) == {5}
+
+
+def test_bin_scores_ties_get_same_score_and_are_monotonic():
+    values = np.array([5, 1, 3, 3, 3, 9, 1, 7, 3, 2])
+    scores = ca._bin_scores(values)
+    for v in np.unique(values):
+        assert len(set(scores[values == v])) == 1
+    order = np.argsort(values, kind="stable")
+    assert np.all(np.diff(scores[order]) >= 0)
+
+
+def test_bin_scores_distinct_values_fill_all_bins():
+    scores = ca._bin_scores(np.arange(100))
+    assert np.bincount(scores, minlength=6)[1:].tolist() == [20] * 5
+
+
+def test_bin_scores_all_equal_and_empty():
+    assert set(ca._bin_scores(np.full(10, 4.0))) == {1}
+    assert ca._bin_scores(np.array([])).size == 0
+
+
+def test_recency_most_recent_tied_block_scores_top():
+    # Half the customers bought on the last day (recency 1).
+    recency = np.concatenate([np.ones(50), np.arange(2, 52)])
+    r = ca.RFM_BINS + 1 - ca._bin_scores(recency)
+    assert set(r[recency == 1]) == {5}
+
+
+def test_one_order_recent_average_spender_is_not_champion():
+    freq = np.repeat([1, 2, 3, 5], [70, 20, 7, 3])
+    f = ca._bin_scores(freq)
+    r = np.full(freq.size, 5, dtype=np.int8)
+    m = np.full(freq.size, 3, dtype=np.int8)
+    seg = ca._segment(r, f, m)
+    assert "Champions" not in {ca.SEGMENTS[i] for i in seg[freq == 1]}
+
+
+def test_segment_rules():
+    r = np.array([5, 4, 5, 4, 2, 1, 2, 1])
+    f = np.array([5, 3, 2, 1, 4, 5, 1, 1])
+    m = np.array([5, 3, 2, 1, 4, 5, 1, 1])
+    names = [ca.SEGMENTS[i] for i in ca._segment(r, f, m)]
+    assert names == [
+        "Champions", "Loyal", "Potential Loyalist", "New",
+        "At Risk", "Can't Lose", "Hibernating", "Lost",
+    ]
+
+
+def _matrices():
+    # (cohort, month, active customers, sales) as returned by the cohort query
+    cohort = np.array([0, 0, 0, 1, 1, 3])
+    month = np.array([0, 1, 2, 1, 3, 3])
+    customers = np.array([10, 6, 4, 5, 2, 7])
+    sales = np.array([100.0, 60.0, 40.0, 50.0, 20.0, 70.0])
+    return ca.cohort_matrices(cohort + 24000, month + 24000, customers, sales)
+
+
+def test_cohort_matrices():
+    act = _matrices()
+    assert act["sizes"].tolist() == [10, 5, 0, 7]
+    assert act["active"][0].tolist() == [10, 6, 4]
+    assert act["active"][1].tolist() == [5, 0, 2]
+    assert act["revenue"][0].tolist() == [100.0, 60.0, 40.0]
+
+
+def test_cohorts_summary_skips_empty_cohorts():
+    out = ca.cohorts_summary(_matrices(), max_offset=12)
+    assert [c["cohort"] for c in out] == ["2000-01", "2000-02", "2000-04"]
+    assert out[0]["lifetime_revenue"] == 200.0
+
+
+def test_retention_matrix_truncates_unobserved_offsets():
+    out = ca.retention_matrix(_matrices(), max_offset=12)
+    rows = {r["cohort"]: r for r in out["rows"]}
+    assert rows["2000-01"]["retention"] == [1.0, 0.6, 0.4]
+    assert rows["2000-02"]["retained"] == [5, 0, 2]
+    assert rows["2000-04"]["retained"] == [7]
+
+
+def test_rfm_customers_filters_and_pages():
+    table = {
+        "customer_id": np.array([1, 2, 3]),
+        "recency": np.array([1, 5, 9]),
+        "frequency": np.array([3, 1, 1]),
+        "monetary": np.array([10.0, 30.0, 20.0]),
+        "r": np.array([5, 3, 1], dtype=np.int8),
+        "f": np.array([5, 1, 1], dtype=np.int8),
+        "m": np.array([2, 5, 4], dtype=np.int8),
+        "segment": np.array([0, 6, 7], dtype=np.int8),
+    }
+    assert [c["customer_id"] for c in ca.rfm_customers(table, None, 2, 0)] == [2, 3]
+    assert [c["customer_id"] for c in ca.rfm_customers(table, "Lost", 10, 0)] == [3]
+
+
+def test_result_cache_is_versioned_and_bounded():
+    ca.set_cached(1, "a", 1)
+    assert ca.get_cached(1, "a") == 1
+    assert ca.get_cached(2, "a") is None
+    for i in range(ca.CACHE_MAX_ENTRIES + 5):
+        ca.set_cached(2, f"k{i}", i)
+    assert len(ca._results) == ca.CACHE_MAX_ENTRIES
+    assert ca.get_cached(2, "k0") is None
+    assert ca.get_cached(2, f"k{ca.CACHE_MAX_ENTRIES + 4}") == ca.CACHE_MAX_ENTRIES + 4
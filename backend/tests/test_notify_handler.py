@@ -0,0 +1,55 @@
+import asyncio
+from datetime import date, timedelta
+
+import anomaly
+import app
+
+START = date(2024, 1, 1)
+
+
+def _seeded():
+    d = anomaly.StreamingDetector()
+    d.seed("A", "day", [(START + timedelta(i), 100.0 + (5 if i % 2 else -5)) for i in range(30)])
+    return d
+
+
+def _deliver(worker_id, detector, payload, monkeypatch):
+    """Run notify_handler as the worker `worker_id` with its own detector."""
+    monkeypatch.setattr(app, "WORKER_ID", worker_id)
+    monkeypatch.setattr(app, "detector", detector)
+
+    async def run():
+        await app.notify_handler(None, 0, "sales_changes", payload)
+        await asyncio.sleep(0)  # let the broadcast task run
+
+    asyncio.run(run())
+
+
+def test_workers_detectors_agree_through_notify_handler(monkeypatch):
+    w1, w2 = _seeded(), _seeded()
+    writes = [
+        ("w1", [("A", START + timedelta(29), 120.0)]),
+        ("w2", [("A", START + timedelta(30), 90.0)]),
+        ("w1", [("A", START + timedelta(30), -90.0), ("B", START + timedelta(31), 90.0)]),
+        ("w2", [("A", START + timedelta(31), 2000.0)]),
+    ]
+    for writer, changes in writes:
+        payload = anomaly.write_payload(writer, changes)
+        # Postgres delivers the NOTIFY to every listener, the writer included.
+        _deliver("w1", w1, payload, monkeypatch)
+        _deliver("w2", w2, payload, monkeypatch)
+    assert w1.state() == w2.state()
+    day = [s for s in w1.state() if s["category"] == "A" and s["granularity"] == "day"][0]
+    assert day["period"] == (START + timedelta(31)).isoformat()
+    assert day["current_total"] == 2000.0
+
+
+def test_foreign_write_clears_cache_own_write_does_not(monkeypatch):
+    payload = anomaly.write_payload("other", [])
+    app.set_cache("dashboard:All", {"x": 1})
+    _deliver("me", _seeded(), anomaly.write_payload("me", []), monkeypatch)
+    assert app.get_cache("dashboard:All") == {"x": 1}
+    version = app.data_version
+    _deliver("me", _seeded(), payload, monkeypatch)
+    assert app.get_cache("dashboard:All") is None
+    assert app.data_version == version + 1
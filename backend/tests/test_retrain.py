@@ -0,0 +1,72 @@
+from datetime import date
+
+import pandas as pd
+
+import retrain
+
+
+def _ts(months, start="2024-01-01", value=100.0):
+    return pd.DataFrame({"ds": pd.date_range(start, periods=months, freq="MS"), "y": [value] * months})
+
+
+def _entry(snapshot):
+    return {"fingerprint": retrain.fingerprint(snapshot), "months": dict(snapshot)}
+
+
+def test_snapshot_excludes_open_month():
+    snap = retrain.series_snapshot(_ts(8), date(2024, 8, 15))
+    assert sorted(snap) == [f"2024-0{m}-01" for m in range(1, 8)]
+
+
+def test_unchanged_and_open_month_trickle_skip():
+    ts = _ts(8)
+    entry = _entry(retrain.series_snapshot(ts, date(2024, 8, 15)))
+    ts.loc[7, "y"] = 500.0  # open month keeps growing
+    action, reason = retrain.decide(retrain.series_snapshot(ts, date(2024, 8, 20)), entry, True)
+    assert (action, reason) == ("skip", "series unchanged")
+
+
+def test_month_partial_at_training_time_is_new_when_it_closes():
+    ts = _ts(8)
+    entry = _entry(retrain.series_snapshot(ts, date(2024, 8, 15)))
+    action, reason = retrain.decide(retrain.series_snapshot(ts, date(2024, 9, 2)), entry, True)
+    assert action == "refit"
+    assert reason == "new month(s) completed: 2024-08-01"
+
+
+def test_revision_threshold():
+    ts = _ts(8)
+    entry = _entry(retrain.series_snapshot(ts, date(2024, 8, 15)))
+    ts.loc[2, "y"] = 101.0
+    assert retrain.decide(retrain.series_snapshot(ts, date(2024, 8, 15)), entry, True)[0] == "skip"
+    ts.loc[2, "y"] = 110.0
+    action, reason = retrain.decide(retrain.series_snapshot(ts, date(2024, 8, 15)), entry, True)
+    assert action == "refit" and reason.startswith("2024-03-01 revised")
+
+
+def test_removed_month_and_missing_model():
+    ts = _ts(8)
+    snap = retrain.series_snapshot(ts, date(2024, 8, 15))
+    entry = _entry(snap)
+    fewer = {m: y for m, y in snap.items() if m != "2024-02-01"}
+    assert retrain.decide(fewer, entry, True) == ("refit", "month(s) removed: 2024-02-01")
+    assert retrain.decide(snap, None, False) == ("refit", "no trained model")
+    assert retrain.decide(snap, None, True)[0] == "refit"
+
+
+def test_too_few_completed_months():
+    snap = retrain.series_snapshot(_ts(6), date(2024, 6, 10))
+    assert retrain.decide(snap, None, False)[0] == "skip"
+
+
+def test_registry_save_uses_private_temp_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrain.forecasting, "MODELS_DIR", str(tmp_path))
+    monkeypatch.setattr(retrain, "REGISTRY_PATH", str(tmp_path / "registry.json"))
+    a = retrain.RetrainScheduler(None, None, None, None, None)
+    b = retrain.RetrainScheduler(None, None, None, None, None)
+    a.registry = {"A": {"fingerprint": "x", "months": {}}}
+    b.registry = {"B": {"fingerprint": "y", "months": {}}}
+    a._save_registry()
+    b._save_registry()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["registry.json"]
+    assert a._load_registry() == b.registry